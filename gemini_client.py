@@ -7,6 +7,10 @@ Integrates Google Gemini with MCP tools for interactive sales analytics
 import asyncio
 import os
 import sys
+from datetime import datetime
+from typing import Any
+import httpx
+from aioconsole import ainput
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
@@ -15,10 +19,47 @@ from google.genai import types
 from mcp_client import MCPClient
 
 
+# Connection pool limits shared by the sync and async Gemini HTTP clients
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=100)
+
+# One Gemini client per API key, shared so TCP/TLS connections are reused
+_GENAI_CLIENTS: dict[str, genai.Client] = {}
+
+
+def get_genai_client(api_key: str) -> genai.Client:
+    """
+    Get the shared Gemini client for an API key, creating it on first use.
+    
+    Args:
+        api_key: Gemini API key
+        
+    Returns:
+        Gemini client backed by pooled keep-alive HTTP connections
+    
+    Note:
+        The limits apply to the httpx clients. When aiohttp is installed the
+        SDK sends async requests through aiohttp and drops the httpx-only
+        'limits' argument, so the async path (used by send_message) then
+        keeps aiohttp's default connection pool instead.
+    """
+    client = _GENAI_CLIENTS.get(api_key)
+    if client is None:
+        client = genai.Client(
+            api_key=api_key,
+            http_options=types.HttpOptions(
+                client_args={"limits": HTTP_LIMITS},
+                async_client_args={"limits": HTTP_LIMITS}
+            )
+        )
+        _GENAI_CLIENTS[api_key] = client
+    return client
+
+
 class GeminiAgent:
     """Gemini agent with MCP tool integration."""
     
-    def __init__(self, api_key: str, model_name: str, mcp_client: MCPClient):
+    def __init__(self, api_key: str, model_name: str, mcp_client: MCPClient,
+                 client: genai.Client | None = None):
         """
         Initialize Gemini agent.
         
@@ -26,17 +67,26 @@ class GeminiAgent:
             api_key: Gemini API key
             model_name: Gemini model name
             mcp_client: Connected MCP client
+            client: Optional Gemini client (default: shared client for api_key)
         """
         self.api_key = api_key
         self.model_name = model_name
         self.mcp_client = mcp_client
         
-        # Create Gemini client
-        self.client = genai.Client(api_key=api_key)
+        # Print tool call arguments when GEMINI_DEBUG is set
+        self.debug = os.getenv("GEMINI_DEBUG", "").lower() in ("1", "true", "yes")
+        
+        # Reuse the shared, connection-pooled Gemini client
+        self.client = client or get_genai_client(api_key)
         
         # Get tools from MCP client and convert to Gemini format
         self.function_declarations = self._convert_tools_to_gemini()
         
+        # Build the tool and generation config once; each chat only swaps in a
+        # fresh system instruction so the current date stays accurate
+        self._tool = types.Tool(function_declarations=self.function_declarations)
+        self._config = types.GenerateContentConfig(tools=[self._tool], temperature=0.7)
+        
         print(f"✓ Initialized Gemini ({model_name}) with {len(self.function_declarations)} tools")
     
     def _convert_tools_to_gemini(self) -> list[types.FunctionDeclaration]:
@@ -71,6 +121,54 @@ class GeminiAgent:
         
         return function_declarations
     
+    def _build_system_instruction(self) -> str:
+        """
+        Build the system instruction telling Gemini how to present tool results.
+        
+        Returns:
+            System instruction text
+        """
+        now = datetime.now()
+        return f"""You are a sales analytics assistant. Use the available tools to answer questions about sales data.
+
+IMPORTANT CONTEXT:
+- Current date: {now.strftime('%B %d, %Y')} (Year: {now.year})
+- Each forecast_sales point has a date "ds", a model estimate "yhat" and a range "yhat_lower" to "yhat_upper"
+- forecast_sales returns fitted HISTORY followed by the forecast: when include_history is true, only the last 6 points are FUTURE forecasts
+- Points dated before {now.strftime('%B %Y')} are history, not forecasts; describe them as past estimates
+- Pay attention to the YEARS in the "ds" dates and always quote them exactly as returned; never assume an earlier year
+
+When a tool returns data, format it nicely for the user."""
+    
+    def _build_tool_payload(self, result: Any) -> dict[str, str]:
+        """
+        Turn an MCP tool call outcome into a FunctionResponse payload.
+        
+        Args:
+            result: Tool result, or the exception raised by the call
+            
+        Returns:
+            {"result": text} on success, {"error": message} otherwise
+        """
+        # gather() may also hand back BaseExceptions such as CancelledError
+        if isinstance(result, BaseException):
+            print(f"❌ Error calling tool: {result!r}")
+            return {"error": str(result) or type(result).__name__}
+        
+        try:
+            # Extract text from result
+            result_text = result.content[0].text
+        except (AttributeError, IndexError, TypeError) as e:
+            print(f"❌ Unreadable tool result: {e}")
+            return {"error": f"Tool returned no text content: {e}"}
+        
+        if getattr(result, 'isError', False):
+            print(f"❌ Tool reported an error: {result_text}")
+            return {"error": result_text}
+        
+        print(f"✓ Tool result received ({len(result_text)} chars)")
+        return {"result": result_text}
+    
     async def send_message(self, message: str) -> str:
         """
         Send a message to Gemini and handle tool calls.
@@ -83,79 +181,61 @@ class GeminiAgent:
         """
         print(f"\n💬 You: {message}")
         
-        # Create chat with tools
-        chat = self.client.chats.create(
+        # Create async chat with tools so network calls don't block the event loop
+        chat = self.client.aio.chats.create(
             model=self.model_name,
-            config=types.GenerateContentConfig(
-                tools=[types.Tool(function_declarations=self.function_declarations)],
-                temperature=0.7
+            config=self._config.model_copy(
+                update={"system_instruction": self._build_system_instruction()}
             )
         )
         
         # Send initial message
-        response = chat.send_message(message)
+        response = await chat.send_message(message)
         
         # Handle function calls
         while response.candidates[0].content.parts:
-            part = response.candidates[0].content.parts[0]
+            # Collect every function call Gemini emitted in this turn
+            function_calls = [
+                part.function_call
+                for part in response.candidates[0].content.parts
+                if getattr(part, 'function_call', None)
+            ]
             
-            # Check if it's a function call
-            if hasattr(part, 'function_call') and part.function_call:
-                function_call = part.function_call
-                
-                print(f"\n🔧 Gemini calling tool: {function_call.name}")
-                print(f"   Arguments: {dict(function_call.args)}")
-                
-                # Execute the function call via MCP
-                try:
-                    result = await self.mcp_client.call_tool(
-                        function_call.name,
-                        dict(function_call.args)
-                    )
-                    
-                    # Extract text from result
-                    result_text = result.content[0].text
-                    print(f"✓ Tool result received ({len(result_text)} chars)")
-                    
-                    # Add context about current date for forecast interpretation
-                    import json
-                    from datetime import datetime
-                    
-                    # If it's a forecast, add explicit date context
-                    if function_call.name == "forecast_sales":
-                        try:
-                            forecast_data = json.loads(result_text)
-                            if "forecast" in forecast_data and forecast_data["forecast"]:
-                                first_date = forecast_data["forecast"][0]["ds"]
-                                last_date = forecast_data["forecast"][-1]["ds"]
-                                
-                                # Create very explicit context message
-                                context_message = f"""IMPORTANT CONTEXT:
-- Current date: {datetime.now().strftime('%B %d, %Y')} (Year: 2026)
-- These are FUTURE sales forecasts
-- Forecast period: {first_date} to {last_date}
-- Pay attention to the YEARS in the dates - they are 2025 and 2026, NOT 2024
-
-Here is the forecast data from the {function_call.name} function:
-
-{result_text}
-
-Please format this data nicely for the user, making sure to use the CORRECT YEARS from the data (2025-2026)."""
-                        except:
-                            context_message = f"Here is the data from the {function_call.name} function:\n\n{result_text}\n\nPlease format this nicely for the user."
-                    else:
-                        context_message = f"Here is the data from the {function_call.name} function:\n\n{result_text}\n\nPlease format this nicely for the user."
-                    
-                    # Send function response back to Gemini
-                    response = chat.send_message(context_message)
-                except Exception as e:
-                    print(f"❌ Error calling tool: {e}")
-                    response = chat.send_message(
-                        f"Error calling function {function_call.name}: {str(e)}"
-                    )
-            else:
+            if not function_calls:
                 # No more function calls, break
                 break
+            
+            # Convert each call's arguments to a plain dict once
+            call_args = [dict(function_call.args or {}) for function_call in function_calls]
+            
+            for function_call, args in zip(function_calls, call_args):
+                print(f"\n🔧 Gemini calling tool: {function_call.name}")
+                if self.debug:
+                    print(f"   Arguments: {args}")
+            
+            # Execute all function calls via MCP concurrently
+            results = await asyncio.gather(
+                *(
+                    self.mcp_client.call_tool(function_call.name, args)
+                    for function_call, args in zip(function_calls, call_args)
+                ),
+                return_exceptions=True
+            )
+            
+            # Build one reply covering every call, in the order Gemini emitted them
+            response_parts = []
+            for function_call, result in zip(function_calls, results):
+                payload = self._build_tool_payload(result)
+                response_parts.append(types.Part(
+                    function_response=types.FunctionResponse(
+                        id=function_call.id,
+                        name=function_call.name,
+                        response=payload
+                    )
+                ))
+            
+            # Send all function responses back to Gemini in a single turn
+            response = await chat.send_message(response_parts)
         
         # Get final text response
         final_response = response.text if hasattr(response, 'text') else str(response)
@@ -204,7 +284,7 @@ async def main():
         # Conversation loop
         while True:
             try:
-                user_input = input("You: ").strip()
+                user_input = (await ainput("You: ")).strip()
                 
                 if user_input.lower() in ['quit', 'exit', 'q']:
                     print("\n👋 Goodbye!")
@@ -8,6 +8,7 @@ import asyncio
 import json
 import sys
 from typing import Any, Dict, List, Optional
+from aioconsole import ainput
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 
@@ -29,6 +30,7 @@ class MCPClient:
             env=None
         )
         self.session: Optional[ClientSession] = None
+        self.mcp_tools: List[Any] = []
         
     async def connect(self) -> ClientSession:
         """Connect to the MCP server and return the session"""
@@ -41,8 +43,7 @@ class MCPClient:
         await self.session.initialize()
         
         # Load and store tools for Gemini agent
-        tools_response = await self.session.list_tools()
-        self.mcp_tools = tools_response.tools
+        await self.list_tools(refresh=True)
         
         return self.session
     
@@ -52,13 +53,25 @@ class MCPClient:
             await self.session_context.__aexit__(None, None, None)
             await self.client_context.__aexit__(None, None, None)
     
-    async def list_tools(self) -> List[Any]:
-        """List all available tools from the server"""
+    async def list_tools(self, refresh: bool = False) -> List[Any]:
+        """
+        List all available tools from the server
+        
+        Args:
+            refresh: Query the server even if tools are already cached
+            
+        Returns:
+            List of tools (cached after the first call)
+        """
         if not self.session:
             raise RuntimeError("Not connected to server. Call connect() first.")
         
+        if self.mcp_tools and not refresh:
+            return self.mcp_tools
+        
         tools_response = await self.session.list_tools()
-        return tools_response.tools
+        self.mcp_tools = tools_response.tools
+        return self.mcp_tools
     
     async def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> Any:
         """
@@ -102,7 +115,7 @@ class MCPClient:
         
         while True:
             try:
-                user_input = input(">>> ").strip()
+                user_input = (await ainput(">>> ")).strip()
                 
                 if not user_input:
                     continue
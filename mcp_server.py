@@ -5,14 +5,36 @@ Provides tools for analyzing sales data and forecasting
 """
 
 import asyncio
-import json
+import hashlib
+import re
+import threading
+from functools import lru_cache
 from pathlib import Path
 from typing import Any
 
+import numpy as np
+import orjson
 import pandas as pd
 from mcp.server import Server
 from mcp.server.stdio import stdio_server
 from mcp.types import Tool, TextContent
+from statsmodels.tsa.holtwinters import ExponentialSmoothing
+
+# Import Prophet at startup so the first forecast doesn't pay for it
+try:
+    from prophet import Prophet
+    from prophet.serialize import model_from_json, model_to_json
+    _HAS_PROPHET = True
+except ImportError:
+    try:
+        from fbprophet import Prophet
+        from fbprophet.serialize import model_from_json, model_to_json
+        _HAS_PROPHET = True
+    except ImportError:
+        _HAS_PROPHET = False
+
+# Warm up pandas' groupby extension code paths before the first tool call
+pd.DataFrame([{'a': 1, 'b': 1}]).groupby('a').sum()
 
 
 # Initialize server
@@ -21,12 +43,259 @@ app = Server("sales-analytics-server")
 # Path to data file
 DATA_PATH = Path(__file__).parent / "data" / "sample_sales_data.csv"
 
+# Compact dtypes for the sales CSV (PRODUCT_ID is an alphanumeric code, e.g. 'PMA-93040')
+SALES_DTYPES = {
+    'OPERATION_NAME': 'category',
+    'PRODUCT_ID': 'category',
+    'PRODUCT_NAME': 'category',
+    'UNITS_SOLD': 'int32',
+    'CALENDAR_YEAR': 'int16',
+    'CALENDAR_MONTH': 'int8',
+}
+
+# Number of months to forecast
+FORECAST_PERIODS = 6
+
+# Minimum months of history needed to fit any forecast model
+MIN_HISTORY_POINTS = 2
+
+# Series shorter than this are forecast with exponential smoothing instead of Prophet
+PROPHET_MIN_POINTS = 120
+
+# Season length (months) for exponential smoothing
+SEASONAL_PERIODS = 12
+
+# z-score of an 80% interval, matching Prophet's default interval_width
+INTERVAL_Z = 1.2816
+
+# Directory for persisted forecast models
+CACHE_DIR = Path(__file__).parent / "cache"
+
+# Fitted Prophet models keyed by (operation_lower, data file mtime, history length)
+_PROPHET_CACHE: dict[tuple[str, int, int], Any] = {}
+
+# Maximum number of fitted models kept in memory
+PROPHET_CACHE_SIZE = 32
+
+# Serializes model fitting across tool calls running in worker threads
+_PROPHET_LOCK = threading.Lock()
+
 
-def load_data() -> pd.DataFrame:
-    """Load sales data from CSV file"""
+def load_tables() -> dict[str, Any]:
+    """
+    Load sales data together with aggregates precomputed for the tools
+    (cached until the file changes on disk)
+    
+    Returns:
+        Dictionary with keys:
+            sales: Raw sales rows
+            product_totals: UNITS_SOLD summed per operation and product
+            monthly: UNITS_SOLD summed per operation and month, with a Date column
+            mtime_ns: Modification time of the CSV these tables were built from
+    """
     if not DATA_PATH.exists():
         raise FileNotFoundError(f"Data file not found: {DATA_PATH}")
-    return pd.read_csv(DATA_PATH)
+    return _build_tables(DATA_PATH, DATA_PATH.stat().st_mtime_ns)
+
+
+@lru_cache(maxsize=1)
+def _build_tables(path: Path, mtime_ns: int) -> dict[str, Any]:
+    """
+    Parse the sales CSV and build aggregates once per (path, mtime)
+    
+    Args:
+        path: Path to the CSV file
+        mtime_ns: File modification time, part of the cache key
+        
+    Returns:
+        Dictionary as described in load_tables(). The DataFrames are
+        shared by tool calls running in worker threads and must be treated
+        as read-only.
+    """
+    df = pd.read_csv(path, dtype=SALES_DTYPES)
+    df['OPERATION_NAME_LC'] = df['OPERATION_NAME'].str.lower().astype('category')
+    
+    product_totals = df.groupby(
+        ['OPERATION_NAME_LC', 'PRODUCT_ID', 'PRODUCT_NAME'], observed=True
+    )['UNITS_SOLD'].sum().reset_index()
+    
+    monthly = df.groupby(
+        ['OPERATION_NAME_LC', 'CALENDAR_YEAR', 'CALENDAR_MONTH'], observed=True
+    )['UNITS_SOLD'].sum().reset_index()
+    monthly['Date'] = pd.to_datetime(dict(
+        year=monthly['CALENDAR_YEAR'],
+        month=monthly['CALENDAR_MONTH'],
+        day=1
+    ))
+    
+    return {
+        "sales": df,
+        "product_totals": product_totals,
+        "monthly": monthly,
+        "mtime_ns": mtime_ns,
+    }
+
+
+def operation_mask(df: pd.DataFrame, operation_lower: str) -> pd.Series:
+    """
+    Boolean mask of rows whose operation name contains a lowercased substring
+    
+    The substring test runs once per distinct operation (categorical
+    category) and rows are then selected by integer category code.
+    
+    Args:
+        df: DataFrame with a categorical OPERATION_NAME_LC column
+        operation_lower: Lowercased operation filter
+        
+    Returns:
+        Boolean Series aligned with df
+    """
+    op_lc = df['OPERATION_NAME_LC'].cat
+    matching_codes = [
+        code for code, name in enumerate(op_lc.categories)
+        if operation_lower in name
+    ]
+    return op_lc.codes.isin(matching_codes)
+
+
+def _prophet_cache_prefix(operation_lower: str) -> str:
+    """Build a filesystem-safe cache file name prefix for an operation"""
+    slug = re.sub(r'[^a-z0-9]+', '_', operation_lower).strip('_') or 'all'
+    digest = hashlib.sha1(operation_lower.encode()).hexdigest()[:8]
+    return f"prophet_{slug}_{digest}"
+
+
+def _prophet_cache_path(operation_lower: str, mtime_ns: int, n_points: int) -> Path:
+    """Build the cache file path for a fitted model"""
+    return CACHE_DIR / f"{_prophet_cache_prefix(operation_lower)}_{mtime_ns}_{n_points}.json"
+
+
+def _prune_prophet_cache(operation_lower: str, mtime_ns: int) -> None:
+    """
+    Evict cached models built from outdated data (caller holds _PROPHET_LOCK)
+    
+    Drops in-memory models whose data mtime differs from mtime_ns, keeps at
+    most PROPHET_CACHE_SIZE - 1 entries (oldest first out) to make room for a
+    new one, and deletes this operation's cache files with an older mtime.
+    
+    Args:
+        operation_lower: Lowercased operation filter
+        mtime_ns: Modification time of the current CSV
+    """
+    for key in [key for key in _PROPHET_CACHE if key[1] != mtime_ns]:
+        del _PROPHET_CACHE[key]
+    while len(_PROPHET_CACHE) >= PROPHET_CACHE_SIZE:
+        del _PROPHET_CACHE[next(iter(_PROPHET_CACHE))]
+    
+    for path in CACHE_DIR.glob(f"{_prophet_cache_prefix(operation_lower)}_*.json"):
+        try:
+            file_mtime_ns = int(path.stem.rsplit('_', 2)[1])
+        except (IndexError, ValueError):
+            continue
+        if file_mtime_ns < mtime_ns:
+            path.unlink(missing_ok=True)
+
+
+def get_prophet_model(operation_lower: str, df_prophet: pd.DataFrame, mtime_ns: int) -> Any:
+    """
+    Return a fitted Prophet model for an operation, fitting only on cache miss
+    
+    Models are kept in memory and their fitted parameters are serialized
+    under CACHE_DIR with prophet.serialize, so they survive restarts without
+    re-running the Stan optimizer. Keys are the lowercased operation filter,
+    the data file mtime and the history length, so a change to the CSV
+    invalidates them. Models from older data are evicted when a new model is
+    cached, and the in-memory cache holds at most PROPHET_CACHE_SIZE models.
+    
+    Args:
+        operation_lower: Lowercased operation filter
+        df_prophet: Training data with 'ds' and 'y' columns
+        mtime_ns: Modification time of the CSV df_prophet was built from
+        
+    Returns:
+        Fitted Prophet model
+    """
+    key = (operation_lower, mtime_ns, len(df_prophet))
+    model = _PROPHET_CACHE.get(key)
+    if model is not None:
+        return model
+    
+    with _PROPHET_LOCK:
+        # Another thread may have fitted this model while we waited
+        model = _PROPHET_CACHE.get(key)
+        if model is not None:
+            return model
+        
+        _prune_prophet_cache(operation_lower, mtime_ns)
+        
+        cache_path = _prophet_cache_path(*key)
+        if cache_path.exists():
+            try:
+                model = model_from_json(cache_path.read_text())
+            except Exception:
+                # Corrupt or incompatible cache file, refit below
+                model = None
+        
+        if model is None:
+            model = Prophet()
+            model.fit(df_prophet)
+            try:
+                CACHE_DIR.mkdir(exist_ok=True)
+                cache_path.write_text(model_to_json(model))
+            except OSError:
+                # Persisting is best effort, the in-memory cache still applies
+                pass
+        
+        _PROPHET_CACHE[key] = model
+        return model
+
+
+def ets_forecast(df_prophet: pd.DataFrame, periods: int) -> pd.DataFrame:
+    """
+    Forecast a short monthly series with Holt-Winters exponential smoothing
+    
+    Months missing from the history are filled with 0 units sold so the
+    series is gap-free, as Holt-Winters assumes evenly spaced observations.
+    Trend and seasonal components are only enabled when the series is long
+    enough to estimate them. Intervals are yhat +/- INTERVAL_Z residual
+    standard deviations.
+    
+    Args:
+        df_prophet: Monthly history with 'ds' and 'y' columns, sorted by 'ds'
+        periods: Number of future months to forecast
+        
+    Returns:
+        DataFrame with 'ds', 'yhat', 'yhat_lower', 'yhat_upper' covering every
+        month of the history followed by the forecast months
+    """
+    history_dates = pd.date_range(df_prophet['ds'].iloc[0], df_prophet['ds'].iloc[-1], freq='MS')
+    y = (
+        df_prophet.set_index('ds')['y']
+        .reindex(history_dates, fill_value=0)
+        .to_numpy(dtype=np.float64)
+    )
+    seasonal = 'add' if len(y) >= 2 * SEASONAL_PERIODS else None
+    
+    fit = ExponentialSmoothing(
+        y,
+        trend='add' if len(y) >= 4 else None,
+        seasonal=seasonal,
+        seasonal_periods=SEASONAL_PERIODS if seasonal else None
+    ).fit()
+    
+    yhat = np.concatenate([fit.fittedvalues, fit.forecast(periods)])
+    margin = INTERVAL_Z * np.std(y - fit.fittedvalues)
+    
+    future_dates = pd.date_range(
+        history_dates[-1] + pd.DateOffset(months=1), periods=periods, freq='MS'
+    )
+    
+    return pd.DataFrame({
+        'ds': history_dates.append(future_dates),
+        'yhat': yhat,
+        'yhat_lower': yhat - margin,
+        'yhat_upper': yhat + margin
+    })
 
 
 def top_n_products(n: int, operation: str) -> dict[str, Any]:
@@ -38,13 +307,13 @@ def top_n_products(n: int, operation: str) -> dict[str, Any]:
         operation: Operation name to filter by
         
     Returns:
-        Dictionary with top products data
+        Dictionary with top products data ("products" is a DataFrame)
     """
-    df_data = load_data()
+    product_totals = load_tables()["product_totals"]
     
     # Filter by operation (case-insensitive)
     operation_lower = operation.lower()
-    df_temp = df_data[df_data['OPERATION_NAME'].str.lower().str.contains(operation_lower)]
+    df_temp = product_totals[operation_mask(product_totals, operation_lower)]
     
     if df_temp.empty:
         return {
@@ -52,25 +321,30 @@ def top_n_products(n: int, operation: str) -> dict[str, Any]:
             "products": []
         }
     
-    # Group by product and sum units sold
-    df_grouped = df_temp.groupby(['PRODUCT_ID', 'PRODUCT_NAME'])['UNITS_SOLD'].sum().reset_index()
-    
-    # Get top N products
-    df_top_n = df_grouped.sort_values("UNITS_SOLD", ascending=False).head(n)
+    # Combine per-product totals across all matching operations
+    df_grouped = df_temp.groupby(['PRODUCT_ID', 'PRODUCT_NAME'], observed=True)['UNITS_SOLD'].sum().reset_index()
     
-    # Convert to list of dictionaries
-    products = df_top_n.to_dict('records')
+    # Get top N products: partial selection, then sort only the winners
+    neg_units = -df_grouped['UNITS_SOLD'].to_numpy()
+    k = max(0, min(n, len(neg_units)))
+    idx = np.argpartition(neg_units, k - 1)[:k] if 0 < k < len(neg_units) else np.arange(k)
+    idx = idx[np.argsort(neg_units[idx], kind='stable')]
+    df_top_n = df_grouped.iloc[idx]
     
+    # Records are serialized straight from the DataFrame by dumps_result()
     return {
         "operation": operation,
         "top_n": n,
-        "products": products
+        "products": df_top_n
     }
 
 
 def forecast_sales(operation: str, include_history: bool = True, start_date: str = None) -> dict[str, Any]:
     """
-    Forecast sales for the next 6 months using Prophet
+    Forecast sales for the next 6 months
+    
+    Series shorter than PROPHET_MIN_POINTS months use exponential smoothing,
+    longer ones use Prophet.
     
     Args:
         operation: Operation name to filter by
@@ -78,23 +352,14 @@ def forecast_sales(operation: str, include_history: bool = True, start_date: str
         start_date: Optional start date to filter forecast (YYYY-MM-DD format)
         
     Returns:
-        Dictionary with forecast data
+        Dictionary with forecast data ("forecast" is a DataFrame)
     """
-    try:
-        from prophet import Prophet
-    except ImportError:
-        try:
-            from fbprophet import Prophet
-        except ImportError:
-            return {
-                "error": "Prophet library not installed. Install with: pip install prophet"
-            }
-    
-    df_data = load_data()
+    tables = load_tables()
+    monthly = tables["monthly"]
     
     # Filter by operation (case-insensitive)
     operation_lower = operation.lower()
-    df_temp = df_data[df_data['OPERATION_NAME'].str.lower().str.contains(operation_lower)]
+    df_temp = monthly[operation_mask(monthly, operation_lower)]
     
     if df_temp.empty:
         return {
@@ -102,51 +367,49 @@ def forecast_sales(operation: str, include_history: bool = True, start_date: str
             "forecast": []
         }
     
-    # Group by year and month
-    df_grouped = df_temp.groupby(['CALENDAR_YEAR', 'CALENDAR_MONTH'])['UNITS_SOLD'].sum().reset_index()
+    # Combine monthly totals across all matching operations
+    # (groupby sorts its keys, so the result is already in date order)
+    df_grouped = df_temp.groupby('Date')['UNITS_SOLD'].sum().reset_index()
     
-    # Create date column
-    df_grouped['Date'] = (
-        df_grouped['CALENDAR_YEAR'].astype(str)
-        + '-'
-        + df_grouped['CALENDAR_MONTH'].astype(str).str.zfill(2)
-        + '-01'
-    )
-    df_grouped['Date'] = pd.to_datetime(df_grouped['Date'])
-    df_grouped = df_grouped.sort_values('Date')
+    # Create Prophet dataframe
+    df_prophet = df_grouped.rename(columns={'Date': 'ds', 'UNITS_SOLD': 'y'})
     
-    # Prepare data for Prophet
-    input_series = df_grouped.set_index('Date')['UNITS_SOLD']
+    if len(df_prophet) < MIN_HISTORY_POINTS:
+        return {
+            "error": f"Not enough history to forecast operation: {operation} "
+                     f"(need at least {MIN_HISTORY_POINTS} months, found {len(df_prophet)})",
+            "forecast": []
+        }
     
-    # Create Prophet dataframe
-    df_prophet = input_series.rename("y").to_frame().reset_index()
-    df_prophet.columns = ['ds', 'y']
-    
-    # Fit Prophet model
-    m = Prophet()
-    m.fit(df_prophet)
-    
-    # Create future dataframe for next 6 months
-    last_date = df_prophet['ds'].max()
-    future_end = last_date + pd.DateOffset(months=6)
-    future_dates = pd.date_range(start=last_date, end=future_end, freq='MS')
-    
-    if include_history:
-        future = pd.DataFrame({
-            'ds': pd.concat([df_prophet['ds'], pd.Series(future_dates)], ignore_index=True).drop_duplicates().sort_values()
-        })
+    if len(df_prophet) < PROPHET_MIN_POINTS:
+        # Short series: exponential smoothing instead of a Stan fit
+        forecast = ets_forecast(df_prophet, FORECAST_PERIODS)
+        if not include_history:
+            forecast = forecast.tail(FORECAST_PERIODS)
+    elif not _HAS_PROPHET:
+        return {
+            "error": "Prophet library not installed. Install with: pip install prophet"
+        }
     else:
-        future = pd.DataFrame({'ds': future_dates})
-    
-    # Generate forecast
-    forecast = m.predict(future)
+        # Fit Prophet model (or reuse a cached fit)
+        m = get_prophet_model(operation_lower, df_prophet, tables["mtime_ns"])
+        
+        # Generate forecast for next 6 months
+        future = m.make_future_dataframe(
+            periods=FORECAST_PERIODS,
+            freq='MS',
+            include_history=include_history
+        )
+        forecast = m.predict(future)
     
-    # Extract relevant columns and convert to records
-    forecast_data = forecast[['ds', 'yhat', 'yhat_lower', 'yhat_upper']].copy()
-    forecast_data['ds'] = forecast_data['ds'].dt.strftime('%Y-%m-%d')
-    forecast_data['yhat'] = forecast_data['yhat'].round(0).astype(int)
-    forecast_data['yhat_lower'] = forecast_data['yhat_lower'].round(0).astype(int)
-    forecast_data['yhat_upper'] = forecast_data['yhat_upper'].round(0).astype(int)
+    # Extract relevant columns, rounding all three value columns in one pass
+    values = np.rint(forecast[['yhat', 'yhat_lower', 'yhat_upper']].to_numpy()).astype(np.int32)
+    forecast_data = pd.DataFrame({
+        'ds': forecast['ds'].dt.strftime('%Y-%m-%d').to_numpy(),
+        'yhat': values[:, 0],
+        'yhat_lower': values[:, 1],
+        'yhat_upper': values[:, 2]
+    })
     
     # Filter by start_date if provided
     if start_date:
@@ -160,8 +423,29 @@ def forecast_sales(operation: str, include_history: bool = True, start_date: str
         "operation": operation,
         "include_history": include_history,
         "start_date": start_date,
-        "forecast": forecast_data.to_dict('records')
+        "forecast": forecast_data
+    }
+
+
+def dumps_result(result: dict[str, Any]) -> str:
+    """
+    Serialize a tool result to a JSON object string
+    
+    DataFrame values are written as record lists by pandas' C JSON writer and
+    embedded as orjson fragments, avoiding an intermediate list of Python dicts.
+    
+    Args:
+        result: Tool result, values may be JSON-serializable or DataFrames
+        
+    Returns:
+        JSON string
+    """
+    payload = {
+        key: orjson.Fragment(value.to_json(orient='records'))
+        if isinstance(value, pd.DataFrame) else value
+        for key, value in result.items()
     }
+    return orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode()
 
 
 @app.list_tools()
@@ -189,7 +473,7 @@ async def list_tools() -> list[Tool]:
         ),
         Tool(
             name="forecast_sales",
-            description="Forecast sales for the next 6 months using Prophet time series model. Returns predicted values with confidence intervals. Can optionally filter results to show forecasts starting from a specific date.",
+            description="Forecast sales for the next 6 months using a time series model (exponential smoothing for short histories, Prophet otherwise). Returns predicted values with confidence intervals. Can optionally filter results to show forecasts starting from a specific date.",
             inputSchema={
                 "type": "object",
                 "properties": {
@@ -215,7 +499,7 @@ async def list_tools() -> list[Tool]:
 
 @app.call_tool()
 async def call_tool(name: str, arguments: Any) -> list[TextContent]:
-    """Handle tool calls"""
+    """Handle tool calls (pandas/forecast work runs in a worker thread)"""
     try:
         if name == "top_n_products":
             n = arguments.get("n")
@@ -224,7 +508,7 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
             if not n or not operation:
                 raise ValueError("Both 'n' and 'operation' parameters are required")
             
-            result = top_n_products(n, operation)
+            result = await asyncio.to_thread(top_n_products, n, operation)
             
         elif name == "forecast_sales":
             operation = arguments.get("operation")
@@ -234,20 +518,20 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
             if not operation:
                 raise ValueError("'operation' parameter is required")
             
-            result = forecast_sales(operation, include_history, start_date)
+            result = await asyncio.to_thread(forecast_sales, operation, include_history, start_date)
             
         else:
             raise ValueError(f"Unknown tool: {name}")
         
         return [TextContent(
             type="text",
-            text=json.dumps(result, indent=2)
+            text=dumps_result(result)
         )]
         
     except Exception as e:
         return [TextContent(
             type="text",
-            text=json.dumps({"error": str(e)}, indent=2)
+            text=dumps_result({"error": str(e)})
         )]
 
 